@@ -6,9 +6,64 @@ from __future__ import annotations
 import csv
 import io
 import json
-from typing import Any
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Callable, Iterator
 
-from processor import TelegramMessage
+from processor import MessageBatch, TelegramMessage
+
+# openpyxl импортируется один раз при загрузке модуля, а не на каждый вызов export_excel
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+EXCEL_AVAILABLE = openpyxl is not None
+
+# Быстрый JSON: orjson -> ujson (если нет колеса orjson под платформу) -> stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+ORJSON_AVAILABLE = orjson is not None
+
+if orjson is not None:
+    def json_loads(content: bytes | memoryview) -> Any:
+        # orjson принимает bytes/memoryview напрямую, без промежуточного decode в str
+        return orjson.loads(content)
+
+    def _dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+elif ujson is not None:
+    def json_loads(content: bytes | memoryview) -> Any:
+        return ujson.loads(content)
+
+    def _dumps(obj: Any) -> str:
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+    def _dumps_bytes(obj: Any) -> bytes:
+        return _dumps(obj).encode("utf-8")
+else:
+    def json_loads(content: bytes | memoryview) -> Any:
+        return json.loads(content)
+
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def _dumps_bytes(obj: Any) -> bytes:
+        return _dumps(obj).encode("utf-8")
+
+
+# Сколько сообщений форматируется за один кусок в потоковых iter_* экспортёрах
+STREAM_BATCH = 2000
 
 
 class ExportOptions:
@@ -47,102 +102,166 @@ class ExportOptions:
         return o
 
 
-def _row(msg: TelegramMessage, opts: ExportOptions) -> dict[str, Any]:
-    d: dict[str, Any] = {"message_id": msg.message_id, "text_content": msg.text_content}
+def _scalar_fields(opts: ExportOptions) -> list[str]:
+    """Поля TelegramMessage (кроме reactions_breakdown), включённые в экспорт, в порядке колонок."""
+    fields = ["message_id", "text_content"]
     if opts.include_timestamp:
-        d["timestamp"] = msg.timestamp
+        fields.append("timestamp")
     if opts.include_sender:
-        d["sender_id"] = msg.sender_id
-        d["sender_name"] = msg.sender_name
+        fields += ["sender_id", "sender_name"]
     if opts.include_reply_id:
-        d["reply_to_id"] = msg.reply_to_id
+        fields.append("reply_to_id")
     if opts.include_reactions:
-        d["reactions_count"] = msg.reactions_count
+        fields.append("reactions_count")
     if opts.include_views:
-        d["views"] = msg.views
-    if opts.include_reaction_breakdown:
-        d["reactions_breakdown"] = msg.reactions_breakdown
-    return d
+        fields.append("views")
+    return fields
 
 
-def _row_flat(msg: TelegramMessage, opts: ExportOptions) -> dict[str, Any]:
-    d = _row(msg, opts)
-    if "reactions_breakdown" in d:
-        d["reactions_json"] = json.dumps(d.pop("reactions_breakdown"), ensure_ascii=False)
-    return d
+@lru_cache(maxsize=None)
+def _compile_row(fields: tuple[str, ...]) -> Callable[[TelegramMessage], dict[str, Any]]:
+    """
+    Генерирует функцию строки без ветвлений: def row(msg): return {"field": msg.field, ...}.
+    Имена полей берутся только из _scalar_fields, внешние данные в исходник не попадают.
+    """
+    body = ", ".join(f"{name!r}: msg.{name}" for name in fields)
+    namespace: dict[str, Any] = {}
+    exec(f"def row(msg):\n    return {{{body}}}\n", namespace)
+    return namespace["row"]
 
 
-def export_csv(messages: list[TelegramMessage], opts: ExportOptions) -> str:
-    """Экспорт в CSV (строка)."""
-    if not messages:
-        return ""
-    row0 = _row_flat(messages[0], opts)
-    fieldnames = list(row0.keys())
-    buf = io.StringIO()
-    writer = csv.DictWriter(buf, fieldnames=fieldnames, lineterminator="\n")
-    writer.writeheader()
-    for msg in messages:
-        writer.writerow(_row_flat(msg, opts))
-    return buf.getvalue()
+def _row_builder(opts: ExportOptions) -> Callable[[TelegramMessage], dict[str, Any]]:
+    """Функция строки-словаря (JSONL) для набора полей из opts; кэшируется по набору полей."""
+    fields = _scalar_fields(opts)
+    if opts.include_reaction_breakdown:
+        fields.append("reactions_breakdown")
+    return _compile_row(tuple(fields))
 
 
-def export_jsonl(messages: list[TelegramMessage], opts: ExportOptions) -> str:
-    """Экспорт в JSONL (одна строка JSON на сообщение)."""
-    lines = []
-    for msg in messages:
-        lines.append(json.dumps(_row(msg, opts), ensure_ascii=False))
-    return "\n".join(lines)
+def _flat_rows(
+    messages: list[TelegramMessage], opts: ExportOptions
+) -> tuple[list[str], Iterator[tuple[Any, ...]]]:
+    """
+    Заголовки и строки-кортежи для CSV/Excel.
+    Строки склеиваются zip'ом из колонок MessageBatch, без dict на каждое сообщение.
+    """
+    headers = _scalar_fields(opts)
+    wanted = [*headers, "reactions_breakdown"] if opts.include_reaction_breakdown else headers
+    batch = MessageBatch.from_messages(messages, wanted)
+    columns = [getattr(batch, h) for h in headers]
+    if opts.include_reaction_breakdown:
+        headers.append("reactions_json")
+        columns.append(list(map(_dumps, batch.reactions_breakdown)))
+    return headers, zip(*columns)
 
 
-def export_txt(messages: list[TelegramMessage], opts: ExportOptions) -> str:
-    """Читаемый TXT: [дата] Имя (ID: x): текст {Reactions: n}."""
-    out = []
-    for msg in messages:
-        parts = []
-        if opts.include_timestamp and msg.timestamp:
-            parts.append(f"[{msg.timestamp}]")
-        if opts.include_sender and msg.sender_name:
-            parts.append(f"{msg.sender_name} (ID: {msg.sender_id}):" if opts.include_sender else f"{msg.sender_name}:")
+def _txt_formatter(opts: ExportOptions) -> Callable[[TelegramMessage], str]:
+    """Собирает функцию форматирования строки TXT; флаги opts читаются один раз."""
+    include_timestamp = opts.include_timestamp
+    include_sender = opts.include_sender
+    include_reactions = opts.include_reactions
+    include_breakdown = opts.include_reaction_breakdown
+    include_views = opts.include_views
+    include_reply_id = opts.include_reply_id
+
+    def fmt(msg: TelegramMessage) -> str:
+        text = msg.text_content or ""
+        if include_sender and msg.sender_name:
+            line = "%s (ID: %s): %s" % (msg.sender_name, msg.sender_id, text)
         else:
-            parts.append(":")
-        parts.append(msg.text_content or "")
-        if opts.include_reactions and msg.reactions_count:
-            parts.append(f" {{Reactions: {msg.reactions_count}}}")
-        if opts.include_reaction_breakdown and msg.reactions_breakdown:
-            breakdown = ", ".join(f"{emoji}:{count}" for emoji, count in msg.reactions_breakdown.items())
-            parts.append(f" {{Reactions breakdown: {breakdown}}}")
-        if opts.include_views and msg.views:
-            parts.append(f" {{Views: {msg.views}}}")
-        if opts.include_reply_id and msg.reply_to_id is not None:
-            parts.append(f" [reply_to={msg.reply_to_id}]")
-        out.append(" ".join(parts))
-    return "\n".join(out)
+            line = ": " + text
+        if include_timestamp and msg.timestamp:
+            line = "[%s] %s" % (msg.timestamp, line)
+        if include_reactions and msg.reactions_count:
+            line += "  {Reactions: %s}" % msg.reactions_count
+        if include_breakdown and msg.reactions_breakdown:
+            breakdown = ", ".join(["%s:%s" % item for item in msg.reactions_breakdown.items()])
+            line += "  {Reactions breakdown: %s}" % breakdown
+        if include_views and msg.views:
+            line += "  {Views: %s}" % msg.views
+        if include_reply_id and msg.reply_to_id is not None:
+            line += "  [reply_to=%s]" % msg.reply_to_id
+        return line
+
+    return fmt
 
 
 def export_excel(messages: list[TelegramMessage], opts: ExportOptions) -> bytes:
     """Экспорт в Excel (xlsx), возвращает bytes."""
-    try:
-        import openpyxl
-    except ImportError:
+    if openpyxl is None:
         raise RuntimeError("Для Excel установите: pip install openpyxl")
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    if ws is None:
-        raise RuntimeError("Workbook has no active sheet")
-    ws.title = "Messages"
+    # write-only: строки сразу сериализуются в xlsx, без хранения Cell-объектов в памяти
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Messages")
 
-    if not messages:
-        buf = io.BytesIO()
-        wb.save(buf)
-        return buf.getvalue()
-
-    row0 = _row_flat(messages[0], opts)
-    headers = list(row0.keys())
-    ws.append(headers)
-    for msg in messages:
-        ws.append([_row_flat(msg, opts).get(h) for h in headers])
+    if messages:
+        headers, rows = _flat_rows(messages, opts)
+        ws.append(headers)
+        for row in rows:
+            ws.append(row)
 
     buf = io.BytesIO()
     wb.save(buf)
     return buf.getvalue()
+
+
+def _batches(messages: list[TelegramMessage]) -> Iterator[list[TelegramMessage]]:
+    for i in range(0, len(messages), STREAM_BATCH):
+        yield messages[i : i + STREAM_BATCH]
+
+
+def iter_csv(messages: list[TelegramMessage], opts: ExportOptions) -> Iterator[bytes]:
+    """CSV кусками в UTF-8 для потоковой записи (без сборки всей части в одну строку)."""
+    if not messages:
+        return
+    headers, rows = _flat_rows(messages, opts)
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n", quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(headers)
+    while True:
+        writer.writerows(islice(rows, STREAM_BATCH))
+        data = buf.getvalue()
+        if not data:
+            return
+        buf.seek(0)
+        buf.truncate()
+        yield data.encode("utf-8")
+
+
+def iter_jsonl(messages: list[TelegramMessage], opts: ExportOptions) -> Iterator[bytes]:
+    """JSONL кусками в UTF-8 для потоковой записи (без сборки всей части в одну строку)."""
+    row = _row_builder(opts)
+    for i, batch in enumerate(_batches(messages)):
+        if i:
+            yield b"\n"
+        yield b"\n".join([_dumps_bytes(row(msg)) for msg in batch])
+
+
+def iter_txt(messages: list[TelegramMessage], opts: ExportOptions) -> Iterator[bytes]:
+    """TXT кусками в UTF-8 для потоковой записи (без сборки всей части в одну строку)."""
+    fmt = _txt_formatter(opts)
+    for i, batch in enumerate(_batches(messages)):
+        if i:
+            yield b"\n"
+        yield "\n".join([fmt(msg) for msg in batch]).encode("utf-8")
+
+
+def iter_excel(messages: list[TelegramMessage], opts: ExportOptions) -> Iterator[bytes]:
+    """xlsx сам по себе zip-архив и собирается целиком; отдаётся одним куском."""
+    yield export_excel(messages, opts)
+
+
+def export_csv(messages: list[TelegramMessage], opts: ExportOptions) -> str:
+    """Экспорт в CSV (строка)."""
+    return b"".join(iter_csv(messages, opts)).decode("utf-8")
+
+
+def export_jsonl(messages: list[TelegramMessage], opts: ExportOptions) -> str:
+    """Экспорт в JSONL (одна строка JSON на сообщение)."""
+    return b"".join(iter_jsonl(messages, opts)).decode("utf-8")
+
+
+def export_txt(messages: list[TelegramMessage], opts: ExportOptions) -> str:
+    """Читаемый TXT: [дата] Имя (ID: x): текст {Reactions: n}."""
+    return b"".join(iter_txt(messages, opts)).decode("utf-8")
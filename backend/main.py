@@ -4,17 +4,60 @@ FastAPI: загрузка JSON, настройки экспорта, возвр
 from __future__ import annotations
 
 import io
+import mmap
+import multiprocessing
+import os
 import zipfile
-from typing import Literal
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from operator import methodcaller
+from typing import Any, AsyncIterator, BinaryIO, Callable, Iterator, Literal
 
 from fastapi import FastAPI, File, Form, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse
 
-from processor import parse_telegram_json, split_by_context_blocks
-from exporters import ExportOptions, export_csv, export_jsonl, export_txt, export_excel
+from processor import TelegramMessage, parse_telegram_json, split_by_context_blocks
+from exporters import (
+    EXCEL_AVAILABLE,
+    ORJSON_AVAILABLE,
+    ExportOptions,
+    iter_csv,
+    iter_excel,
+    iter_jsonl,
+    iter_txt,
+    json_loads,
+)
+
+# Загрузки от этого размера (starlette уже держит их на диске) разбираются через mmap
+_MMAP_MIN_BYTES = 8 * 1024 * 1024
+
+# Общий пул процессов для Excel: openpyxl — единственный экспорт, которому параллельность окупает pickling части
+EXCEL_WORKERS = min(4, os.cpu_count() or 1)
+_excel_pool: ProcessPoolExecutor | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    global _excel_pool
+    if EXCEL_WORKERS > 1:
+        # не fork: запросы обрабатываются в потоках anyio, fork из потока небезопасен
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _excel_pool = ProcessPoolExecutor(
+            max_workers=EXCEL_WORKERS, mp_context=multiprocessing.get_context(method)
+        )
+    try:
+        yield
+    finally:
+        if _excel_pool is not None:
+            _excel_pool.shutdown(cancel_futures=True)
+            _excel_pool = None
 
-app = FastAPI(title="Telegram JSON Processor", version="1.0.0")
+
+app = FastAPI(title="Telegram JSON Processor", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,6 +69,13 @@ app.add_middleware(
 
 FormatType = Literal["txt", "csv", "jsonl", "excel"]
 
+EXPORTERS: dict[str, tuple[str, Callable[[list[TelegramMessage], ExportOptions], Iterator[bytes]]]] = {
+    "txt": (".txt", iter_txt),
+    "csv": (".csv", iter_csv),
+    "jsonl": (".jsonl", iter_jsonl),
+    "excel": (".xlsx", iter_excel),
+}
+
 
 def _form_bool(v: str | bool) -> bool:
     if isinstance(v, bool):
@@ -33,6 +83,94 @@ def _form_bool(v: str | bool) -> bool:
     return str(v).lower() in ("true", "1", "yes", "on")
 
 
+class _ZipChunkBuffer(io.RawIOBase):
+    """
+    Неперематываемый приёмник для ZipFile: архив пишется последовательно
+    (с data descriptor), а накопленные байты забираются через take().
+    """
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: Any) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _write_part(block: list[TelegramMessage], fmt: str, opts: ExportOptions, fh: BinaryIO) -> None:
+    """Пишет часть в fh кусками, не собирая её целиком в одну строку."""
+    for piece in EXPORTERS[fmt][1](block, opts):
+        fh.write(piece)
+
+
+def _export_part(block: list[TelegramMessage], fmt: str, opts: ExportOptions) -> bytes:
+    """Экспорт одной части в bytes (выполняется в процессе-воркере)."""
+    buf = io.BytesIO()
+    _write_part(block, fmt, opts, buf)
+    return buf.getvalue()
+
+
+def _iter_parts(
+    chunks: list[list[TelegramMessage]], fmt: str, opts: ExportOptions
+) -> Iterator[Callable[[BinaryIO], Any]]:
+    """
+    По порядку отдаёт для каждой части функцию, пишущую её в открытый файл архива.
+    TXT/CSV/JSONL пишутся в архив потоково, прямо из экспортёра: их экспорт дешевле,
+    чем pickling части для другого процесса. Excel при наличии пула считается
+    параллельно; вперёд ставится не больше 2 * EXCEL_WORKERS частей.
+    """
+    pool = _excel_pool
+    if fmt != "excel" or pool is None or len(chunks) <= 1:
+        for block in chunks:
+            yield partial(_write_part, block, fmt, opts)
+        return
+
+    blocks = iter(chunks)
+    pending: deque[Future[bytes]] = deque(
+        pool.submit(_export_part, block, fmt, opts) for block in islice(blocks, 2 * EXCEL_WORKERS)
+    )
+    try:
+        while pending:
+            data = pending.popleft().result()
+            for block in islice(blocks, 1):
+                pending.append(pool.submit(_export_part, block, fmt, opts))
+            yield methodcaller("write", data)
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+def _iter_zip(chunks: list[list[TelegramMessage]], fmt: str, opts: ExportOptions) -> Iterator[bytes]:
+    """Отдаёт ZIP по частям: в памяти держатся только части, которые сейчас экспортируются."""
+    ext = EXPORTERS[fmt][0]
+    buf = _ZipChunkBuffer()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for i, write_part in enumerate(_iter_parts(chunks, fmt, opts), 1):
+            with zf.open(f"part_{i}{ext}", "w", force_zip64=True) as fh:
+                write_part(fh)
+            yield buf.take()
+    yield buf.take()
+
+
+async def _load_upload(file: UploadFile) -> Any:
+    """
+    Разбирает JSON из загруженного файла прямо из bytes, без decode в str.
+    Большой файл при наличии orjson читается через mmap, без копии содержимого в память процесса.
+    """
+    if ORJSON_AVAILABLE and (file.size or 0) >= _MMAP_MIN_BYTES:
+        with mmap.mmap(file.file.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return json_loads(view)
+    return json_loads(await file.read())
+
+
 @app.post("/process")
 async def process(
     file: UploadFile = File(...),
@@ -64,8 +202,7 @@ async def process(
     )
 
     try:
-        content = await file.read()
-        data = __import__("json").loads(content.decode("utf-8", errors="replace"))
+        data = await _load_upload(file)
         messages = parse_telegram_json(data)
     except Exception as e:
         raise HTTPException(400, f"Ошибка парсинга JSON: {e}")
@@ -74,30 +211,11 @@ async def process(
         raise HTTPException(400, "В файле не найдено сообщений.")
 
     chunks = split_by_context_blocks(messages, max_words=word_count, overlap_messages=max(0, min(overlap, 20)))
-    zip_buf = io.BytesIO()
-    zf = zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_DEFLATED)
-
-    ext = {"txt": ".txt", "csv": ".csv", "jsonl": ".jsonl", "excel": ".xlsx"}[fmt]
-
-    for i, block in enumerate(chunks, 1):
-        if fmt == "txt":
-            zf.writestr(f"part_{i}{ext}", export_txt(block, opts))
-        elif fmt == "csv":
-            zf.writestr(f"part_{i}{ext}", export_csv(block, opts))
-        elif fmt == "jsonl":
-            zf.writestr(f"part_{i}{ext}", export_jsonl(block, opts))
-        elif fmt == "excel":
-            try:
-                zf.writestr(f"part_{i}{ext}", export_excel(block, opts))
-            except RuntimeError as e:
-                if "openpyxl" in str(e):
-                    raise HTTPException(500, "Для Excel установите: pip install openpyxl")
-                raise
-
-    zf.close()
-    zip_buf.seek(0)
+    if fmt == "excel" and not EXCEL_AVAILABLE:
+        raise HTTPException(500, "Для Excel установите: pip install openpyxl")
+
     return StreamingResponse(
-        zip_buf,
+        _iter_zip(chunks, fmt, opts),
         media_type="application/zip",
         headers={"Content-Disposition": "attachment; filename=split_result.zip"},
     )
@@ -109,8 +227,7 @@ async def preview(file: UploadFile = File(...), limit: int = Form(5)):
     if not file.filename or not file.filename.lower().endswith(".json"):
         raise HTTPException(400, "Нужен файл .json")
     try:
-        content = await file.read()
-        data = __import__("json").loads(content.decode("utf-8", errors="replace"))
+        data = await _load_upload(file)
         messages = parse_telegram_json(data)
     except Exception as e:
         raise HTTPException(400, f"Ошибка парсинга JSON: {e}")
@@ -4,13 +4,16 @@
 from __future__ import annotations
 
 import json
+from bisect import bisect_right
 from dataclasses import dataclass, field
 from datetime import datetime
+from itertools import accumulate
+from operator import attrgetter
 from pathlib import Path
-from typing import Any, Iterator
+from typing import Any, Iterable, Iterator
 
 
-@dataclass
+@dataclass(slots=True)
 class TelegramMessage:
     """Сообщение с метриками из экспорта Telegram."""
     message_id: int
@@ -22,6 +25,11 @@ class TelegramMessage:
     reactions_count: int = 0
     views: int = 0
     reactions_breakdown: dict[str, int] = field(default_factory=dict)
+    # Считается один раз при создании; используется split_by_context_blocks
+    word_count: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.word_count = len(self.text_content.split())
 
     def to_dict(self) -> dict[str, Any]:
         return {
@@ -37,15 +45,34 @@ class TelegramMessage:
         }
 
 
+@dataclass
+class MessageBatch:
+    """
+    Колоночное (SoA) представление списка TelegramMessage: по списку на поле.
+    Собираются только запрошенные колонки (map(attrgetter) в C), остальные пустые.
+    """
+    message_id: list[int] = field(default_factory=list)
+    text_content: list[str] = field(default_factory=list)
+    timestamp: list[str] = field(default_factory=list)
+    sender_id: list[str | int] = field(default_factory=list)
+    sender_name: list[str] = field(default_factory=list)
+    reply_to_id: list[int | None] = field(default_factory=list)
+    reactions_count: list[int] = field(default_factory=list)
+    views: list[int] = field(default_factory=list)
+    reactions_breakdown: list[dict[str, int]] = field(default_factory=list)
+
+    @classmethod
+    def from_messages(cls, messages: list[TelegramMessage], columns: Iterable[str]) -> "MessageBatch":
+        return cls(**{name: list(map(attrgetter(name), messages)) for name in columns})
+
+
 def _extract_text(obj: Any) -> str:
     """Достаёт текст из поля text (строка или массив частей)."""
     if isinstance(obj, str):
         return obj
     if isinstance(obj, list):
-        return "".join(
-            p.get("text", p) if isinstance(p, dict) else str(p)
-            for p in obj
-        )
+        # список, а не генератор: str.join получает готовую последовательность без промежуточной копии
+        return "".join([p.get("text", p) if type(p) is dict else str(p) for p in obj])
     return ""
 
 
@@ -230,7 +257,8 @@ def parse_telegram_json(data: dict[str, Any]) -> list[TelegramMessage]:
             if msg:
                 out.append(msg)
 
-    out.sort(key=lambda m: (m.timestamp, m.message_id))
+    # sort стабилен: при равных (timestamp, message_id) сохраняется порядок из файла
+    out.sort(key=attrgetter("timestamp", "message_id"))
     return out
 
 
@@ -254,25 +282,18 @@ def split_by_context_blocks(
     if not messages:
         return []
 
+    prefix = [0, *accumulate(map(attrgetter("word_count"), messages))]  # prefix[i] — слов в messages[:i]
+    n = len(messages)
     chunks: list[list[TelegramMessage]] = []
-    current: list[TelegramMessage] = []
-    current_words = 0
-    overlap_buf: list[TelegramMessage] = []
-
-    for msg in messages:
-        words = len(msg.text_content.split())
-        need_new_chunk = current_words + words > max_words and current
-
-        if need_new_chunk and current:
-            chunks.append(current)
-            overlap_buf = current[-overlap_messages:] if overlap_messages else []
-            current = list(overlap_buf)
-            current_words = sum(len(m.text_content.split()) for m in current)
-
-        current.append(msg)
-        current_words += words
-
-    if current:
-        chunks.append(current)
-
-    return chunks
+    start = 0  # индекс первого сообщения текущего блока (вместе с overlap)
+    first_new = 0  # первое сообщение блока, не попавшее в overlap; берётся всегда
+
+    while True:
+        # Граница блока — первое сообщение после first_new, с которым блок превысил бы max_words
+        end = max(bisect_right(prefix, prefix[start] + max_words) - 1, first_new + 1)
+        if end >= n:
+            chunks.append(messages[start:])
+            return chunks
+        chunks.append(messages[start:end])
+        start = max(start, end - overlap_messages) if overlap_messages > 0 else end
+        first_new = end